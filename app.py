@@ -4,9 +4,23 @@ Wraps the Tailscale Funnel endpoint as an MCP-compatible server
 """
 
 import os
-import json
+import sys
+import time
+import shlex
+import base64
+import codecs
+import hashlib
+import signal
+import socket
+import atexit
+import asyncio
+import threading
+from asyncio import run_coroutine_threadsafe
 import httpx
-from flask import Flask, request, jsonify
+import orjson
+import uvloop
+from flask import Flask, Response, request
+from werkzeug.serving import make_server
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -16,6 +30,26 @@ app = Flask(__name__)
 
 MAC_FUNNEL_URL = os.environ.get("MAC_FUNNEL_URL", "https://mac-studio-1556.tailfb6577.ts.net")
 
+# Concurrent requests to the Mac are capped at MAC_MAX_CONNECTIONS by a semaphore
+# on the loop; once all slots are busy, callers wait at most MAC_TIMEOUT.pool and
+# then fail instead of queueing. The httpx pool limit alone is not enough: over
+# HTTP/2 it counts connections, and extra streams wait without a timeout.
+MAC_MAX_CONNECTIONS = int(os.environ.get("MAC_MAX_CONNECTIONS", 100))
+MAC_MAX_KEEPALIVE = int(os.environ.get("MAC_MAX_KEEPALIVE", 20))
+
+# Fail fast on connect, but give long-running shell commands time to finish
+MAC_TIMEOUT = httpx.Timeout(connect=5.0, read=60.0, write=10.0, pool=1.0)
+# The / healthcheck should report "unreachable" quickly when the Mac is down
+HEALTH_TIMEOUT = httpx.Timeout(connect=1.0, read=3.0, write=3.0, pool=1.0)
+
+# Mac endpoint that runs a command and returns raw stdout as application/octet-stream
+MAC_RAW_RUN_ENDPOINT = os.environ.get("MAC_RAW_RUN_ENDPOINT", "/run/raw")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Read-only results that change slowly are reused for a few seconds
+HEALTH_CACHE_TTL = 2.0
+SYSTEM_INFO_CACHE_TTL = 5.0
+
 TOOLS = [
     {
         "name": "run_command",
@@ -124,173 +158,656 @@ TOOLS = [
             "properties": {},
             "required": []
         }
+    },
+    {
+        "name": "batch_execute",
+        "description": "Run several run_command / ssh_to_pi calls in one request. Operations without input_from run "
+                       "concurrently, in no particular order; use input_from to pipe an earlier operation's stdout into "
+                       "a later command, or stopOnError to run them one at a time in order. "
+                       "Returns a {status, result} entry per operation.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "operations": {
+                    "type": "array",
+                    "maxItems": 100,
+                    "description": "Operations to run; those without input_from run concurrently",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "tool": {
+                                "type": "string",
+                                "enum": ["run_command", "ssh_to_pi"],
+                                "description": "Tool to call"
+                            },
+                            "arguments": {
+                                "type": "object",
+                                "description": "Arguments for the tool"
+                            },
+                            "input_from": {
+                                "type": "integer",
+                                "description": "Feed stdout of an earlier operation as stdin: an index, or -1 for the previous one"
+                            }
+                        },
+                        "required": ["tool", "arguments"]
+                    }
+                },
+                "stopOnError": {
+                    "type": "boolean",
+                    "description": "Run operations one at a time in order and skip the rest once one fails (default: false)"
+                }
+            },
+            "required": ["operations"]
+        }
     }
 ]
 
-async def call_mac(endpoint: str, method: str = "GET", data: dict = None):
+BATCH_TOOLS = ("run_command", "ssh_to_pi")
+BATCH_MAX_OPERATIONS = 100
+
+# Background event loops run on uvloop
+asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+def run_async(coro, timeout: float = 120.0):
+    """Run a coroutine on the background loop and wait for its result"""
+    future = run_coroutine_threadsafe(coro, LOOP)
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+async def _create_client():
+    """Build the pooled Funnel client on the background loop"""
+    return httpx.AsyncClient(
+        base_url=MAC_FUNNEL_URL,
+        timeout=MAC_TIMEOUT,
+        verify=False,
+        # Multiplex concurrent calls over one warm connection to the Funnel
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=MAC_MAX_CONNECTIONS,
+            max_keepalive_connections=min(MAC_MAX_KEEPALIVE, MAC_MAX_CONNECTIONS),
+            keepalive_expiry=60.0,
+        ),
+    )
+
+LOOP = None
+CLIENT = None
+_SLOTS = None
+
+def start_background_loop():
+    """Start the long-lived event loop shared by all request threads, and its client
+
+    Called once per process. serve_reuseport forks its workers first, since
+    the loop thread would not survive fork.
+    """
+    global LOOP, CLIENT, _SLOTS
+    LOOP = asyncio.new_event_loop()
+    _SLOTS = asyncio.Semaphore(MAC_MAX_CONNECTIONS)
+    threading.Thread(target=LOOP.run_forever, name="mac-mcp-loop", daemon=True).start()
+    CLIENT = run_async(_create_client())
+
+if __name__ != "__main__":
+    start_background_loop()
+
+@atexit.register
+def _close_client():
+    if CLIENT is None:
+        return
+    run_async(CLIENT.aclose(), timeout=5.0)
+    LOOP.call_soon_threadsafe(LOOP.stop)
+
+async def _acquire_slot():
+    """Take one of the MAC_MAX_CONNECTIONS request slots, waiting at most MAC_TIMEOUT.pool"""
+    try:
+        await asyncio.wait_for(_SLOTS.acquire(), MAC_TIMEOUT.pool)
+    except TimeoutError:
+        raise httpx.PoolTimeout(f"All {MAC_MAX_CONNECTIONS} Mac request slots are busy") from None
+
+async def call_mac(endpoint: str, method: str = "GET", data: dict = None,
+                   timeout=httpx.USE_CLIENT_DEFAULT):
     """Call the Mac Funnel endpoint"""
-    async with httpx.AsyncClient(timeout=60.0, verify=False) as client:
-        url = f"{MAC_FUNNEL_URL}{endpoint}"
-        if method == "GET":
-            response = await client.get(url)
-        else:
-            response = await client.post(url, json=data)
-        return response.json()
+    await _acquire_slot()
+    try:
+        response = await CLIENT.request(method, endpoint, json=data, timeout=timeout)
+    finally:
+        _SLOTS.release()
+    return orjson.loads(response.content)
+
+def describe_error(e: BaseException) -> str:
+    """Message for an exception; httpx timeouts such as PoolTimeout have none"""
+    return str(e) or type(e).__name__
+
+# Cleared the first time the Mac agent turns out not to have the raw endpoint
+_raw_run_supported = True
+
+async def open_raw_run(cmd: str):
+    """Start streaming cmd's raw stdout from the Mac; None if the agent can't
 
-def run_async(coro):
-    import asyncio
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    The returned response holds a request slot until close_raw_run() is called.
+    """
+    global _raw_run_supported
+    if not _raw_run_supported:
+        return None
+    await _acquire_slot()
     try:
-        return loop.run_until_complete(coro)
+        raw_request = CLIENT.build_request("POST", MAC_RAW_RUN_ENDPOINT, json={"command": cmd})
+        response = await CLIENT.send(raw_request, stream=True)
+    except BaseException:
+        _SLOTS.release()
+        raise
+    if response.is_success:
+        return response
+    await close_raw_run(response)
+    if response.status_code in (404, 405):
+        logger.info("Mac agent has no %s, falling back to /run", MAC_RAW_RUN_ENDPOINT)
+        _raw_run_supported = False
+    return None
+
+async def close_raw_run(response):
+    """Close a response from open_raw_run and give back its request slot"""
+    try:
+        await response.aclose()
     finally:
-        loop.close()
+        _SLOTS.release()
+
+async def mac_stdout(cmd: str) -> bytes:
+    """Run cmd on the Mac and return its stdout, skipping the JSON wrapper when possible
+
+    Any non-2xx reply from the raw endpoint falls back to /run, so cmd may run
+    twice; only use this for read-only commands.
+    """
+    response = await open_raw_run(cmd)
+    if response is not None:
+        try:
+            return await response.aread()
+        finally:
+            await close_raw_run(response)
+    result = await call_mac("/run", "POST", {"command": cmd})
+    return result.get("stdout", result.get("error", str(result))).encode()
+
+# Pre-serialized halves of {"content": [{"type": "text", "text": ...}]}
+_TEXT_RESULT_PREFIX = b'{"content":[{"type":"text","text":"'
+_TEXT_RESULT_SUFFIX = b'"}]}'
+
+def raw_text_result(stdout: bytes) -> bytes:
+    """Serialize stdout straight into an MCP text result"""
+    text = orjson.dumps(stdout.decode("utf-8", errors="replace"))[1:-1]
+    return _TEXT_RESULT_PREFIX + text + _TEXT_RESULT_SUFFIX
+
+async def _next_chunk(chunks):
+    return await anext(chunks, None)
+
+class TextStream:
+    """Serialized MCP text result whose text is streamed from an upstream response
+
+    Iterated in the Flask thread while the response body is sent, pulling one
+    chunk at a time from the background loop so the file is never buffered.
+    close() releases the upstream response whether or not iteration started.
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._chunks = None
+        self._closed = False
 
-def handle_tool_call(name: str, arguments: dict):
-    """Handle MCP tool calls"""
+    def __iter__(self):
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._chunks = self._response.aiter_bytes(STREAM_CHUNK_SIZE)
+        is_error = False
+        try:
+            yield _TEXT_RESULT_PREFIX
+            try:
+                while (chunk := run_async(_next_chunk(self._chunks))) is not None:
+                    yield orjson.dumps(decoder.decode(chunk))[1:-1]
+                yield orjson.dumps(decoder.decode(b"", final=True))[1:-1]
+            except Exception as e:
+                message = describe_error(e)
+                logger.error("Stream error: %s", message)
+                is_error = True
+                yield orjson.dumps(f"\nError: {message}")[1:-1]
+            yield b'"}],"isError":true}' if is_error else _TEXT_RESULT_SUFFIX
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._chunks is not None:
+            run_async(self._chunks.aclose(), timeout=5.0)
+        run_async(close_raw_run(self._response), timeout=5.0)
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+async def cached(key: str, ttl: float, fetch, keep=None):
+    """Return the cached value for key if fresh, otherwise await fetch() and cache it
+
+    If keep is given, a fetched value is only cached when keep(value) is true.
+    """
+    with _CACHE_LOCK:
+        entry = _CACHE.get(key)
+    if entry and time.monotonic() - entry[0] < ttl:
+        return entry[1]
+    value = await fetch()
+    if keep is None or keep(value):
+        with _CACHE_LOCK:
+            _CACHE[key] = (time.monotonic(), value)
+    return value
+
+def _fetch_health():
+    # Only the / route uses the tight healthcheck timeout
+    return call_mac("/health", "GET", timeout=HEALTH_TIMEOUT)
+
+def _decode_cmd(text: str) -> str:
+    """Shell snippet that writes text to stdout, safe from quoting and injection"""
+    encoded = base64.b64encode(text.encode()).decode()
+    return f"printf '%s' {encoded} | base64 --decode"
+
+def _batch_request(tool: str, arguments: dict, stdin: str = None):
+    """Endpoint and payload for one batched operation"""
+    command = arguments["command"]
+    if not isinstance(command, str):
+        raise TypeError("command must be a string")
+    if stdin is not None:
+        # Pipe the earlier stdout in on the remote side instead of another round trip
+        command = f"{_decode_cmd(stdin)} | (\n{command}\n)"
+    if tool == "run_command":
+        return "/run", {"command": command}
+    return "/ssh", {
+        "command": command,
+        "host": arguments.get("host", "192.168.25.225"),
+        "user": arguments.get("user", "jstewartrr")
+    }
+
+def _prepare_batch_op(i: int, op: dict, results: list, sources: list):
+    """Endpoint and payload for operation i, or None after recording why it cannot run"""
+    stdin = None
+    if sources[i] is not None:
+        source = results[sources[i]]
+        if source["status"] != "ok":
+            results[i] = {"status": "skipped", "error": f"Input operation {sources[i]} did not succeed"}
+            return None
+        stdin = source["result"].get("stdout") or ""
     try:
-        if name == "run_command":
-            result = run_async(call_mac("/run", "POST", {"command": arguments["command"]}))
-            return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
-        
-        elif name == "ssh_to_pi":
-            data = {
-                "command": arguments["command"],
-                "host": arguments.get("host", "192.168.25.225"),
-                "user": arguments.get("user", "jstewartrr")
-            }
-            result = run_async(call_mac("/ssh", "POST", data))
-            return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
-        
-        elif name == "health_check":
-            result = run_async(call_mac("/health", "GET"))
-            return {"content": [{"type": "text", "text": json.dumps(result, indent=2)}]}
-        
-        elif name == "list_files":
-            path = arguments.get("path", "~")
-            cmd = f"ls -la {path}"
-            result = run_async(call_mac("/run", "POST", {"command": cmd}))
-            return {"content": [{"type": "text", "text": result.get("stdout", result.get("error", str(result)))}]}
-        
-        elif name == "read_file":
-            path = arguments["path"]
-            lines = arguments.get("lines")
-            if lines:
-                if lines < 0:
-                    cmd = f"tail -n {abs(lines)} '{path}'"
-                else:
-                    cmd = f"head -n {lines} '{path}'"
+        return _batch_request(op["tool"], op.get("arguments", {}), stdin)
+    except KeyError as e:
+        results[i] = {"status": "error", "error": f"Missing argument: {e}"}
+    except TypeError as e:
+        results[i] = {"status": "error", "error": f"Invalid arguments: {e}"}
+    return None
+
+def _batch_result(outcome) -> dict:
+    if isinstance(outcome, BaseException):
+        return {"status": "error", "error": describe_error(outcome)}
+    if outcome.get("returncode", 1) != 0:
+        return {"status": "error", "result": outcome}
+    return {"status": "ok", "result": outcome}
+
+async def run_batch(operations: list, stop_on_error: bool = False):
+    """Run batched operations
+
+    By default operations are run layer by layer, gathering independent ones
+    concurrently. With stop_on_error they run one at a time in index order,
+    and everything after the first failure is skipped.
+    """
+    results = [None] * len(operations)
+    sources = [None] * len(operations)
+    depths = [0] * len(operations)
+
+    for i, op in enumerate(operations):
+        if not isinstance(op, dict):
+            results[i] = {"status": "error", "error": "Operation must be an object"}
+            continue
+        if not isinstance(op.get("arguments", {}), dict):
+            results[i] = {"status": "error", "error": "arguments must be an object"}
+            continue
+        tool = op.get("tool")
+        input_from = op.get("input_from")
+        if tool == "batch_execute":
+            results[i] = {"status": "error", "error": "Nested batch_execute is not allowed"}
+        elif tool not in BATCH_TOOLS:
+            results[i] = {"status": "error", "error": f"Unsupported tool in batch: {tool}"}
+        elif input_from is not None:
+            if not isinstance(input_from, int) or isinstance(input_from, bool):
+                results[i] = {"status": "error", "error": f"input_from must be an integer, got {input_from!r}"}
+                continue
+            source = i + input_from if input_from < 0 else input_from
+            if 0 <= source < i:
+                sources[i] = source
+                depths[i] = depths[source] + 1
             else:
-                cmd = f"cat '{path}'"
-            result = run_async(call_mac("/run", "POST", {"command": cmd}))
-            return {"content": [{"type": "text", "text": result.get("stdout", result.get("error", str(result)))}]}
-        
-        elif name == "write_file":
-            path = arguments["path"]
-            content = arguments["content"]
-            append = arguments.get("append", False)
-            
-            # Escape content for shell
-            escaped = content.replace("'", "'\\''")
-            op = ">>" if append else ">"
-            cmd = f"echo '{escaped}' {op} '{path}'"
-            result = run_async(call_mac("/run", "POST", {"command": cmd}))
-            
-            if result.get("returncode", 1) == 0:
-                return {"content": [{"type": "text", "text": f"Successfully wrote to {path}"}]}
-            return {"content": [{"type": "text", "text": f"Error: {result.get('stderr', str(result))}"}], "isError": True}
-        
-        elif name == "get_system_info":
-            cmd = """echo '=== HOSTNAME ===' && hostname && \
-echo '=== UPTIME ===' && uptime && \
-echo '=== CPU ===' && sysctl -n machdep.cpu.brand_string && \
-echo '=== MEMORY ===' && vm_stat | head -5 && \
-echo '=== DISK ===' && df -h / && \
-echo '=== TOP PROCESSES ===' && ps aux | head -10"""
-            result = run_async(call_mac("/run", "POST", {"command": cmd}))
-            return {"content": [{"type": "text", "text": result.get("stdout", result.get("error", str(result)))}]}
-        
+                results[i] = {"status": "error", "error": f"input_from {input_from} does not reference an earlier operation"}
+
+    if stop_on_error:
+        for i, op in enumerate(operations):
+            if results[i] is not None:
+                continue
+            if any(r["status"] != "ok" for r in results[:i]):
+                results[i] = {"status": "skipped", "error": "Stopped after an earlier failure"}
+                continue
+            call = _prepare_batch_op(i, op, results, sources)
+            if call is None:
+                continue
+            try:
+                outcome = await call_mac(call[0], "POST", call[1])
+            except Exception as e:
+                outcome = e
+            results[i] = _batch_result(outcome)
+        return results
+
+    for depth in range(max(depths) + 1 if depths else 0):
+        pending, calls = [], []
+        for i, op in enumerate(operations):
+            if depths[i] != depth or results[i] is not None:
+                continue
+            call = _prepare_batch_op(i, op, results, sources)
+            if call is not None:
+                pending.append(i)
+                calls.append(call)
+
+        # Coroutines are only created once the whole layer is known to be valid
+        outcomes = await asyncio.gather(
+            *(call_mac(endpoint, "POST", data) for endpoint, data in calls),
+            return_exceptions=True,
+        )
+        for i, outcome in zip(pending, outcomes):
+            results[i] = _batch_result(outcome)
+
+    return results
+
+def _json_result(result) -> dict:
+    return {"content": [{"type": "text", "text": orjson.dumps(result, option=orjson.OPT_INDENT_2).decode()}]}
+
+async def _run_command(arguments: dict):
+    result = await call_mac("/run", "POST", {"command": arguments["command"]})
+    return _json_result(result)
+
+async def _ssh_to_pi(arguments: dict):
+    data = {
+        "command": arguments["command"],
+        "host": arguments.get("host", "192.168.25.225"),
+        "user": arguments.get("user", "jstewartrr")
+    }
+    result = await call_mac("/ssh", "POST", data)
+    return _json_result(result)
+
+async def _health_check(arguments: dict):
+    result = await cached("health_check", HEALTH_CACHE_TTL, lambda: call_mac("/health", "GET"))
+    return _json_result(result)
+
+async def _list_files(arguments: dict):
+    path = arguments.get("path", "~")
+    cmd = f"ls -la {path}"
+    return raw_text_result(await mac_stdout(cmd))
+
+async def _read_file(arguments: dict):
+    path = arguments["path"]
+    lines = arguments.get("lines")
+    if lines:
+        if lines < 0:
+            cmd = f"tail -n {abs(lines)} '{path}'"
         else:
-            return {"content": [{"type": "text", "text": f"Unknown tool: {name}"}], "isError": True}
+            cmd = f"head -n {lines} '{path}'"
+    else:
+        cmd = f"cat '{path}'"
+        # Whole files can be huge, so stream them when the Mac supports it
+        response = await open_raw_run(cmd)
+        if response is not None:
+            return TextStream(response)
+    return raw_text_result(await mac_stdout(cmd))
+
+async def _write_file(arguments: dict):
+    path = arguments["path"]
+    content = arguments["content"]
+    append = arguments.get("append", False)
+    
+    # Ship content base64-encoded so it never has to be shell-escaped
+    op = ">>" if append else ">"
+    cmd = f"{_decode_cmd(content)} {op} {shlex.quote(path)}"
+    result = await call_mac("/run", "POST", {"command": cmd})
     
+    if result.get("returncode", 1) == 0:
+        return {"content": [{"type": "text", "text": f"Successfully wrote to {path}"}]}
+    return {"content": [{"type": "text", "text": f"Error: {result.get('stderr', str(result))}"}], "isError": True}
+
+SYSTEM_INFO_SECTIONS = (
+    ("HOSTNAME", "hostname"),
+    ("UPTIME", "uptime"),
+    ("CPU", "sysctl -n machdep.cpu.brand_string"),
+    ("MEMORY", "vm_stat | head -5"),
+    ("DISK", "df -h /"),
+    ("TOP PROCESSES", "ps aux | head -10"),
+)
+
+async def _fetch_system_info():
+    """Run the sections as concurrent requests, so wall time is about the slowest one
+
+    A section that fails is reported under its own label without dropping the
+    rest. Returns the serialized result and whether every section succeeded.
+    """
+    outputs = await asyncio.gather(
+        *(mac_stdout(cmd) for _, cmd in SYSTEM_INFO_SECTIONS),
+        return_exceptions=True,
+    )
+    sections = []
+    complete = True
+    for (label, _), output in zip(SYSTEM_INFO_SECTIONS, outputs):
+        if isinstance(output, BaseException):
+            complete = False
+            output = f"Error: {describe_error(output)}\n".encode()
+        sections.append(b"=== %s ===\n%b" % (label.encode(), output))
+    return raw_text_result(b"".join(sections)), complete
+
+async def _get_system_info(arguments: dict):
+    # Partial results are returned but not cached
+    result, _ = await cached("get_system_info", SYSTEM_INFO_CACHE_TTL, _fetch_system_info,
+                             keep=lambda value: value[1])
+    return result
+
+async def _batch_execute(arguments: dict):
+    operations = arguments["operations"]
+    if not isinstance(operations, list):
+        return {"content": [{"type": "text", "text": "Error: operations must be an array"}], "isError": True}
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return {"content": [{"type": "text", "text": f"Error: at most {BATCH_MAX_OPERATIONS} operations per batch"}], "isError": True}
+    results = await run_batch(operations, arguments.get("stopOnError", False))
+    return _json_result(results)
+
+_TOOL_HANDLERS = {
+    "run_command": _run_command,
+    "ssh_to_pi": _ssh_to_pi,
+    "health_check": _health_check,
+    "list_files": _list_files,
+    "read_file": _read_file,
+    "write_file": _write_file,
+    "get_system_info": _get_system_info,
+    "batch_execute": _batch_execute,
+}
+
+async def handle_tool_call(name: str, arguments: dict):
+    """Handle MCP tool calls on the background loop"""
+    handler = _TOOL_HANDLERS.get(name)
+    if handler is None:
+        return {"content": [{"type": "text", "text": f"Unknown tool: {name}"}], "isError": True}
+    try:
+        return await handler(arguments)
     except Exception as e:
-        logger.error(f"Tool call error: {e}")
-        return {"content": [{"type": "text", "text": f"Error: {str(e)}"}], "isError": True}
+        message = describe_error(e)
+        logger.error("Tool call error: %s", message)
+        if logger.isEnabledFor(logging.DEBUG):
+            # Names only: values can be whole write_file bodies
+            arg_names = sorted(arguments) if isinstance(arguments, dict) else type(arguments).__name__
+            logger.debug("Failed tool call %s with arguments %s", name, arg_names, exc_info=True)
+        return {"content": [{"type": "text", "text": f"Error: {message}"}], "isError": True}
+
+# initialize and tools/list never change at runtime, so serialize them once
+_INIT_RESULT = orjson.dumps({
+    "protocolVersion": "2024-11-05",
+    "capabilities": {"tools": {"listChanged": True}},
+    "serverInfo": {"name": "mac-studio-mcp", "version": "1.0.0"}
+})
+_TOOLS_LIST_RESULT = orjson.dumps({"tools": TOOLS})
+_TOOLS_ETAG = hashlib.blake2b(_TOOLS_LIST_RESULT, digest_size=8).hexdigest()
+
+def _envelope(request_id, result: bytes) -> bytes:
+    """Wrap an already-serialized result in a JSON-RPC response"""
+    return b'{"jsonrpc":"2.0","id":%b,"result":%b}' % (orjson.dumps(request_id), result)
+
+class _StreamEnvelope:
+    """Wrap a streamed, serialized result in a JSON-RPC response
+
+    Werkzeug calls close() when the response ends or the client goes away,
+    which is passed on so the upstream stream is always released.
+    """
+
+    def __init__(self, request_id, result):
+        self._head = b'{"jsonrpc":"2.0","id":%b,"result":' % orjson.dumps(request_id)
+        self._result = result
+
+    def __iter__(self):
+        yield self._head
+        yield from self._result
+        yield b"}"
+
+    def close(self):
+        self._result.close()
+
+def _handle_initialize(request_id, params: dict):
+    return _envelope(request_id, _INIT_RESULT)
+
+def _handle_tools_list(request_id, params: dict):
+    return _envelope(request_id, _TOOLS_LIST_RESULT)
+
+def _handle_tools_call(request_id, params: dict):
+    tool_name = params.get("name", "")
+    arguments = params.get("arguments", {})
+    # One hop onto the loop per call; call_mac enforces its own staged timeouts
+    result = run_async(handle_tool_call(tool_name, arguments), timeout=None)
+    if isinstance(result, bytes):
+        return _envelope(request_id, result)
+    if not isinstance(result, dict):
+        return _StreamEnvelope(request_id, result)
+    return orjson.dumps({
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "result": result
+    })
+
+def _handle_initialized(request_id, params: dict):
+    return _envelope(request_id, b"{}")
+
+_MCP_METHODS = {
+    "initialize": _handle_initialize,
+    "tools/list": _handle_tools_list,
+    "tools/call": _handle_tools_call,
+    "notifications/initialized": _handle_initialized,
+}
 
 def process_mcp_message(data):
+    """Return the serialized response, as bytes or an iterable of byte chunks"""
     method = data.get("method", "")
     params = data.get("params", {})
     request_id = data.get("id", 1)
     
-    if method == "initialize":
-        return {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": {
-                "protocolVersion": "2024-11-05",
-                "capabilities": {"tools": {"listChanged": True}},
-                "serverInfo": {"name": "mac-studio-mcp", "version": "1.0.0"}
-            }
-        }
-    
-    elif method == "tools/list":
-        return {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": {"tools": TOOLS}
-        }
-    
-    elif method == "tools/call":
-        tool_name = params.get("name", "")
-        arguments = params.get("arguments", {})
-        result = handle_tool_call(tool_name, arguments)
-        return {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "result": result
-        }
-    
-    elif method == "notifications/initialized":
-        return {"jsonrpc": "2.0", "id": request_id, "result": {}}
-    
-    else:
-        return {
-            "jsonrpc": "2.0",
-            "id": request_id,
-            "error": {"code": -32601, "message": f"Method not found: {method}"}
-        }
+    handler = _MCP_METHODS.get(method)
+    if handler is not None:
+        return handler(request_id, params)
+    return orjson.dumps({
+        "jsonrpc": "2.0",
+        "id": request_id,
+        "error": {"code": -32601, "message": f"Method not found: {method}"}
+    })
+
+def json_response(body, status: int = 200) -> Response:
+    """Wrap serialized JSON in a Response without going through Flask's JSON provider"""
+    return Response(body, status=status, mimetype="application/json")
 
 @app.route("/", methods=["GET"])
 def health():
     # Also check if Mac is reachable
     try:
-        result = run_async(call_mac("/health", "GET"))
+        result = run_async(cached("/health", HEALTH_CACHE_TTL, _fetch_health))
         mac_status = "connected" if result.get("status") == "ok" else "error"
     except:
         mac_status = "unreachable"
     
-    return jsonify({
+    return json_response(orjson.dumps({
         "status": "healthy",
         "service": "mac-studio-mcp",
         "version": "1.0.0",
         "mac_funnel_url": MAC_FUNNEL_URL,
         "mac_status": mac_status,
         "tools": len(TOOLS)
-    })
+    }))
 
 @app.route("/mcp", methods=["POST"])
 def mcp_handler():
     try:
-        data = request.get_json()
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            data = None
         if not data:
-            return jsonify({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}}), 400
-        response = process_mcp_message(data)
-        return jsonify(response)
+            return json_response(orjson.dumps({"jsonrpc": "2.0", "id": None, "error": {"code": -32700, "message": "Parse error"}}), 400)
+        if data.get("method") == "tools/list":
+            # Reconnecting clients can revalidate the fixed tool list instead of refetching it
+            if request.if_none_match.contains(_TOOLS_ETAG):
+                response = Response(status=304)
+            else:
+                response = json_response(process_mcp_message(data))
+            response.set_etag(_TOOLS_ETAG)
+            return response
+        return json_response(process_mcp_message(data))
     except Exception as e:
-        logger.error(f"MCP handler error: {e}")
-        return jsonify({"jsonrpc": "2.0", "id": 1, "error": {"code": -32603, "message": str(e)}}), 500
+        message = describe_error(e)
+        logger.error("MCP handler error: %s", message)
+        return json_response(orjson.dumps({"jsonrpc": "2.0", "id": 1, "error": {"code": -32603, "message": message}}), 500)
+
+def serve_reuseport(host: str, port: int, workers: int):
+    """Run one server process per worker, each accepting on its own SO_REUSEPORT socket
+
+    The kernel spreads incoming connections across the listeners, so local
+    deployments scale across cores without gunicorn or a reverse proxy.
+    """
+    children = []
+    for _ in range(workers - 1):
+        pid = os.fork()
+        if pid == 0:
+            children = None
+            break
+        children.append(pid)
+    start_background_loop()
+
+    if children:
+        def _stop(signum, frame):
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, _stop)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(128)
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    logger.info("Worker %d accepting on %s:%d", os.getpid(), host, port)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        sock.close()
+        for pid in children or ():
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
 
 if __name__ == "__main__":
     logger.info("Mac Studio MCP Server starting...")
     port = int(os.environ.get("PORT", 8080))
-    app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
+    workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+    if workers > 1:
+        serve_reuseport("0.0.0.0", port, workers)
+    else:
+        start_background_loop()
+        app.run(host="0.0.0.0", port=port, debug=False, threaded=True)
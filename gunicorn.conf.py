@@ -0,0 +1,18 @@
+"""
+Gunicorn settings for the Mac Studio MCP server
+"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+
+# Worker processes give the JSON and httpx paths real parallelism past the GIL
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+threads = 4
+keepalive = 65
+
+# Each worker starts its own background event loop and Mac connection pool at
+# import, which has to happen after fork
+preload_app = False